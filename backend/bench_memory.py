@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark: server RSS bytes per idle, joined WebSocket connection.
+
+Starts server:app under uvicorn in a child process, opens N real websocket
+clients that join sessions and then sit idle, and reports the child's RSS
+growth per connection. That covers everything a connection costs: the uvicorn
+protocol and transport, Starlette's WebSocket, the ws_session task and frame,
+buffers and the signaling state. Each count runs twice, "before" with the
+original dict-based WSClient/Session (eager lock, peers list rebuilt on every
+call) and "after" with the compact ones, so the compaction gain is visible.
+Counts above what the host can open are reported as a linear extrapolation.
+
+Usage: python bench_memory.py [--counts 1000 10000] [--extrapolate 100000] [--per-session 2]
+Needs RLIMIT_NOFILE above 2x the largest count (client and server share the host).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Single-IP clients must not hit the per-IP admission ceilings
+BENCH_ENV = {
+    "WS_MAX_PER_IP": "0",
+    "WS_CONNECT_RATE": "1000000",
+    "WS_CONNECT_BURST": "1000000",
+    "LOG_LEVEL": "WARNING",
+}
+
+
+# -----------------------------
+# Child process: the server under test
+# -----------------------------
+class _LegacyWSClient:
+    def __init__(self, websocket, client_id, role, connected_at=0.0, task=None):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.role = role
+        self.connected_at = connected_at
+        self.task = task
+
+
+class _LegacySession:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.clients = {}
+        self.lock = asyncio.Lock()
+
+    def add_client(self, client):
+        self.clients[client.client_id] = client
+
+    def remove_client(self, client_id):
+        return self.clients.pop(client_id, None)
+
+    def peers(self):
+        return list(self.clients.keys())
+
+
+def serve(port: int, legacy: bool):
+    sys.path.insert(0, str(Path(__file__).parent))
+    import uvicorn
+    import server
+
+    if legacy:
+        # ws_session and get_or_create_session look these up at call time
+        server.WSClient = _LegacyWSClient
+        server.Session = _LegacySession
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning",
+                log_config=None, lifespan="off")
+
+
+# -----------------------------
+# Parent process: clients and measurement
+# -----------------------------
+def raise_fd_limit() -> int:
+    if resource is None:
+        return 0
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        soft = hard
+    return soft
+
+
+def rss_bytes(pid: int) -> int:
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("cannot read RSS; install psutil")
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(legacy: bool) -> Tuple[subprocess.Popen, int]:
+    port = free_port()
+    cmd = [sys.executable, __file__, "--serve", str(port)] + (["--legacy"] if legacy else [])
+    proc = subprocess.Popen(cmd, env={**os.environ, **BENCH_ENV})
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("server process exited")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+async def open_clients(port: int, count: int, per_session: int, tag: str) -> List:
+    import websockets
+
+    sem = asyncio.Semaphore(200)
+
+    async def one(i: int):
+        async with sem:
+            ws = await websockets.connect(
+                f"ws://127.0.0.1:{port}/api/ws/session/{tag}-{i // per_session}",
+                ping_interval=None, open_timeout=30)
+            role = "host" if i % per_session == 0 else "peer"
+            await ws.send(json.dumps({"type": "join", "clientId": f"{tag}-{i}", "role": role}))
+            await asyncio.wait_for(ws.recv(), timeout=30)
+            return ws
+
+    return await asyncio.gather(*(one(i) for i in range(count)))
+
+
+async def close_clients(clients: List):
+    await asyncio.gather(*(ws.close() for ws in clients), return_exceptions=True)
+
+
+async def measure(count: int, per_session: int, legacy: bool) -> Dict:
+    proc, port = start_server(legacy)
+    try:
+        # Warm up lazily imported code paths before taking the baseline
+        await close_clients(await open_clients(port, 50, per_session, "warm"))
+        await asyncio.sleep(1.0)
+        base = rss_bytes(proc.pid)
+
+        clients = await open_clients(port, count, per_session, "idle")
+        await asyncio.sleep(2.0)
+        loaded = rss_bytes(proc.pid)
+        await close_clients(clients)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return {"base": base, "loaded": loaded, "per_conn": (loaded - base) / count}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--extrapolate", type=int, nargs="*", default=[100_000],
+                        help="counts to extrapolate from the largest measured run")
+    parser.add_argument("--per-session", type=int, default=2,
+                        help="clients per session (2 = one host + one peer)")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    parser.add_argument("--legacy", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.legacy)
+        return
+
+    limit = raise_fd_limit()
+    if limit and limit < 2 * max(args.counts) + 100:
+        print(f"⚠️  RLIMIT_NOFILE is {limit}; counts above ~{(limit - 100) // 2} will fail")
+
+    per_session = max(1, args.per_session)
+    results: Dict[str, Dict] = {}
+    print(f"{'connections':>12} {'variant':>8} {'base MiB':>10} {'RSS MiB':>10} {'bytes/conn':>12}")
+    for count in args.counts:
+        for variant in ("before", "after"):
+            r = asyncio.run(measure(count, per_session, variant == "before"))
+            results[variant] = r
+            print(f"{count:>12} {variant:>8} {r['base'] / 2**20:>10.1f} "
+                  f"{r['loaded'] / 2**20:>10.1f} {r['per_conn']:>12.0f}")
+        gain = results["before"]["per_conn"] - results["after"]["per_conn"]
+        print(f"{'':>12} {'saved':>8} {'':>10} {'':>10} {gain:>12.0f}")
+
+    for count in args.extrapolate or []:
+        for variant in ("before", "after"):
+            r = results[variant]
+            est = r["base"] + r["per_conn"] * count
+            print(f"{count:>12} {variant:>8} {r['base'] / 2**20:>10.1f} "
+                  f"{est / 2**20:>10.1f} {r['per_conn']:>12.0f}  (extrapolated)")
+
+
+if __name__ == "__main__":
+    main()
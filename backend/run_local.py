@@ -28,8 +28,9 @@ def main():
     # Launch default browser shortly after server starts
     threading.Thread(target=open_browser_when_ready, args=(url, 2.0), daemon=True).start()
 
-    # Start server (console/terminal app)
-    config = Config(app=app, host=host, port=port, log_level="info")
+    # Start server (console/terminal app). log_config=None keeps uvicorn from
+    # installing its own stderr handlers so its logs go through server.py's queue.
+    config = Config(app=app, host=host, port=port, log_level="info", log_config=None)
     server = Server(config)
     server.run()
 
@@ -1,23 +1,31 @@
-from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File
+from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 # MongoDB removed
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
 import os
 import uuid
 import asyncio
 import json
 import logging
+import logging.handlers
+import queue
+import atexit
 import sys
 import socket
 import re
 import platform
 import subprocess
+import time
+import math
+import threading
+import hmac
+from collections import Counter
 from starlette.staticfiles import StaticFiles
-from starlette.responses import FileResponse, HTMLResponse
+from starlette.responses import FileResponse, HTMLResponse, PlainTextResponse, JSONResponse
 from ftplib import FTP, error_perm
 
 ROOT_DIR = Path(__file__).parent
@@ -26,6 +34,150 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection removed
 
+
+# -----------------------------
+# Logging: handlers run on a QueueListener thread so console/file writes never
+# block the event loop. Structured events go through log_event().
+#   LOG_LEVEL (INFO), LOG_FORMAT (text|json), LOG_CONSOLE (1),
+#   LOG_FILE (unset = no file), LOG_FILE_MAX_BYTES (10 MiB), LOG_FILE_BACKUPS (5),
+#   LOG_SAMPLE_PER_SEC (20, cap for sampled high-volume events, 0 = unlimited),
+#   LOG_QUEUE_SIZE (10000, records beyond this are dropped)
+# -----------------------------
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        event = getattr(record, "event", None)
+        if event:
+            data["event"] = event
+        fields = getattr(record, "fields", None)
+        if fields:
+            data.update(fields)
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never formats or blocks on the calling thread."""
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Records stay in-process, so skip the stdlib eager formatting; the
+        # listener thread formats them.
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class EventSampler:
+    """Fixed one-second window cap per event name; counts what it suppresses."""
+    __slots__ = ("per_sec", "_window", "_counts", "_suppressed")
+
+    def __init__(self, per_sec: int):
+        self.per_sec = per_sec
+        self._window = 0
+        self._counts: Dict[str, int] = {}
+        self._suppressed: Dict[str, int] = {}
+
+    def allow(self, event: str) -> Optional[int]:
+        """Return None to drop, else the number suppressed since the last emit."""
+        if self.per_sec <= 0:
+            return 0
+        window = int(time.monotonic())
+        if window != self._window:
+            self._window = window
+            self._counts.clear()
+        n = self._counts.get(event, 0)
+        if n >= self.per_sec:
+            self._suppressed[event] = self._suppressed.get(event, 0) + 1
+            return None
+        self._counts[event] = n + 1
+        return self._suppressed.pop(event, 0)
+
+
+def setup_logging() -> DroppingQueueHandler:
+    # uvicorn's default config gives its loggers their own synchronous stdout
+    # handlers; route them through the root queue handler instead.
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uv_logger = logging.getLogger(name)
+        uv_logger.handlers = []
+        uv_logger.propagate = True
+
+    root = logging.getLogger()
+    for h in root.handlers:
+        if isinstance(h, DroppingQueueHandler):
+            return h
+
+    level = os.environ.get("LOG_LEVEL", "INFO").upper()
+    if os.environ.get("LOG_FORMAT", "text").lower() == "json":
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        formatter = TextFormatter('%(asctime)s - %(levelname)s - %(message)s')
+
+    handlers: List[logging.Handler] = []
+    if os.environ.get("LOG_CONSOLE", "1").lower() not in ("0", "false", "no"):
+        handlers.append(logging.StreamHandler(sys.stderr))
+    log_file = os.environ.get("LOG_FILE")
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=int(os.environ.get("LOG_FILE_MAX_BYTES", 10 * 1024 * 1024)),
+            backupCount=int(os.environ.get("LOG_FILE_BACKUPS", 5)),
+            encoding="utf-8",
+        ))
+    for h in handlers:
+        h.setFormatter(formatter)
+
+    q: queue.Queue = queue.Queue(maxsize=int(os.environ.get("LOG_QUEUE_SIZE", 10000)))
+    queue_handler = DroppingQueueHandler(q)
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler
+
+
+_queue_handler = setup_logging()
+logger = logging.getLogger(__name__)
+_event_sampler = EventSampler(int(os.environ.get("LOG_SAMPLE_PER_SEC", 20)))
+
+
+def log_event(event: str, level: int = logging.INFO, sampled: bool = False, **fields):
+    """Emit a structured event. sampled=True applies the per-second cap."""
+    if not logger.isEnabledFor(level):
+        return
+    if sampled:
+        suppressed = _event_sampler.allow(event)
+        if suppressed is None:
+            return
+        if suppressed:
+            fields["suppressed"] = suppressed
+    logger.log(level, event, extra={"event": event, "fields": fields})
+
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -78,40 +230,281 @@ def get_frontend_build_dir() -> Optional[Path]:
     return None
 
 
+# -----------------------------
+# Admission control: token buckets keyed by client IP / session plus global
+# concurrency ceilings. Checks run in AdmissionMiddleware before the websocket
+# is accepted or the FTP request body is read. Set a rate or ceiling to 0 to
+# disable it, or RATE_LIMITS=0 to turn admission control off entirely.
+# -----------------------------
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+RATE_LIMITS_ENABLED = os.environ.get("RATE_LIMITS", "1").lower() not in ("0", "false", "no")
+WS_SESSION_PREFIX = "/api/ws/session/"
+FTP_PREFIX = "/api/ftp/"
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """Token bucket per key. rate is tokens/second, burst the bucket size."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_keys = max_keys
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def allow(self, key: str, cost: float = 1.0) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self.prune(now)
+            bucket = self.buckets[key] = TokenBucket(self.burst, now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        if bucket.tokens >= cost:
+            bucket.tokens -= cost
+            return True
+        return False
+
+    def prune(self, now: float):
+        # Buckets that would have refilled by now are indistinguishable from new ones
+        refill = self.burst / self.rate
+        for key in [k for k, b in self.buckets.items() if now - b.updated >= refill]:
+            del self.buckets[key]
+
+
+class Admission:
+    def __init__(self):
+        self.ws_connect_ip = RateLimiter(_env_float("WS_CONNECT_RATE", 2), _env_float("WS_CONNECT_BURST", 20))
+        self.ws_msg_ip = RateLimiter(_env_float("WS_MSG_RATE", 50), _env_float("WS_MSG_BURST", 200))
+        self.ws_msg_session = RateLimiter(_env_float("WS_SESSION_MSG_RATE", 200), _env_float("WS_SESSION_MSG_BURST", 800))
+        self.ftp_ip = RateLimiter(_env_float("FTP_RATE", 1), _env_float("FTP_BURST", 5))
+        # Global and per-session ceilings are off by default so one host can
+        # serve a large venue; the per-IP ceiling still stops a single client.
+        self.ws_max_total = int(_env_float("WS_MAX_CONNECTIONS", 0))
+        self.ws_max_per_ip = int(_env_float("WS_MAX_PER_IP", 32))
+        self.ws_max_per_session = int(_env_float("WS_MAX_PER_SESSION", 0))
+        self.ftp_max_concurrent = int(_env_float("FTP_MAX_CONCURRENT", 4))
+        self.ftp_max_per_ip = int(_env_float("FTP_MAX_PER_IP", 2))
+
+        self.ws_total = 0
+        self.ws_per_ip: Counter = Counter()
+        self.ws_per_session: Counter = Counter()
+        self.ftp_in_flight = 0
+        self.ftp_per_ip: Counter = Counter()
+        self.rejected: Counter = Counter()
+
+    def reject(self, reason: str, ip: str) -> str:
+        self.rejected[reason] += 1
+        log_event("admission.reject", logging.WARNING, sampled=True, reason=reason, ip=ip)
+        return reason
+
+    def admit_ws(self, ip: str, session_id: str) -> Optional[str]:
+        """Reserve a websocket slot; returns a rejection reason or None."""
+        if self.ws_max_total and self.ws_total >= self.ws_max_total:
+            return self.reject("ws_connect.capacity", ip)
+        if self.ws_max_per_ip and self.ws_per_ip[ip] >= self.ws_max_per_ip:
+            return self.reject("ws_connect.ip_concurrency", ip)
+        if self.ws_max_per_session and self.ws_per_session[session_id] >= self.ws_max_per_session:
+            return self.reject("ws_connect.session_concurrency", ip)
+        if not self.ws_connect_ip.allow(ip):
+            return self.reject("ws_connect.ip_rate", ip)
+        self.ws_total += 1
+        self.ws_per_ip[ip] += 1
+        self.ws_per_session[session_id] += 1
+        return None
+
+    def release_ws(self, ip: str, session_id: str):
+        self.ws_total -= 1
+        for counts, key in ((self.ws_per_ip, ip), (self.ws_per_session, session_id)):
+            counts[key] -= 1
+            if counts[key] <= 0:
+                del counts[key]
+
+    def allow_ws_message(self, ip: str) -> bool:
+        """Per-IP message rate; the caller closes the sender when this fails."""
+        if not self.ws_msg_ip.allow(ip):
+            self.reject("ws_message.ip_rate", ip)
+            return False
+        return True
+
+    def allow_session_message(self, ip: str, session_id: str) -> bool:
+        """Shared per-session rate; the caller drops the message and sends the
+        sender a backoff frame, so nobody is disconnected for another's flood."""
+        if not self.ws_msg_session.allow(session_id):
+            self.reject("ws_message.session_rate", ip)
+            return False
+        return True
+
+    def session_retry_after_ms(self) -> int:
+        # Time for the shared bucket to earn one token back
+        rate = self.ws_msg_session.rate
+        return max(1, math.ceil(1000 / rate)) if rate > 0 else 0
+
+    def admit_ftp(self, ip: str) -> Optional[str]:
+        if self.ftp_max_concurrent and self.ftp_in_flight >= self.ftp_max_concurrent:
+            return self.reject("ftp.capacity", ip)
+        if self.ftp_max_per_ip and self.ftp_per_ip[ip] >= self.ftp_max_per_ip:
+            return self.reject("ftp.ip_concurrency", ip)
+        if not self.ftp_ip.allow(ip):
+            return self.reject("ftp.ip_rate", ip)
+        self.ftp_in_flight += 1
+        self.ftp_per_ip[ip] += 1
+        return None
+
+    def release_ftp(self, ip: str):
+        self.ftp_in_flight -= 1
+        self.ftp_per_ip[ip] -= 1
+        if self.ftp_per_ip[ip] <= 0:
+            del self.ftp_per_ip[ip]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": RATE_LIMITS_ENABLED,
+            "ws_connections": self.ws_total,
+            "ftp_in_flight": self.ftp_in_flight,
+            "rejected": dict(self.rejected),
+            "rejected_total": sum(self.rejected.values()),
+        }
+
+
+admission = Admission()
+
+
+def _client_ip(scope) -> str:
+    client = scope.get("client")
+    return client[0] if client else ""
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware so rejections happen before any handler work."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not RATE_LIMITS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        path = scope.get("path", "")
+        if scope["type"] == "websocket" and path.startswith(WS_SESSION_PREFIX):
+            ip = _client_ip(scope)
+            session_id = path[len(WS_SESSION_PREFIX):]
+            if admission.admit_ws(ip, session_id):
+                await receive()
+                if "websocket.http.response" in scope.get("extensions", {}):
+                    await send({"type": "websocket.http.response.start", "status": 429,
+                                "headers": [(b"retry-after", b"1"), (b"content-type", b"text/plain")]})
+                    await send({"type": "websocket.http.response.body", "body": b"Too Many Requests"})
+                else:
+                    # Closing before accept makes the server answer the handshake with 403
+                    await send({"type": "websocket.close"})
+                return
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                admission.release_ws(ip, session_id)
+        elif scope["type"] == "http" and path.startswith(FTP_PREFIX):
+            ip = _client_ip(scope)
+            reason = admission.admit_ftp(ip)
+            if reason:
+                response = JSONResponse({"detail": "Too Many Requests", "reason": reason},
+                                        status_code=429, headers={"Retry-After": "1"})
+                await response(scope, receive, send)
+                return
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                admission.release_ftp(ip)
+        else:
+            await self.app(scope, receive, send)
+
+
+@api_router.get("/admission/stats")
+async def admission_stats():
+    return admission.stats()
+
+
 # -----------------------------
 # WebSocket Signaling for WebRTC
 # -----------------------------
+KNOWN_ROLES = {r: r for r in ("host", "peer", "guest", "unknown")}
+
+
+def normalize_role(role) -> str:
+    # Map onto a fixed set so every client shares the same role strings
+    return KNOWN_ROLES.get(role, "unknown") if type(role) is str else "unknown"
+
+
 class WSClient:
-    def __init__(self, websocket: WebSocket, client_id: str, role: str):
+    __slots__ = ("websocket", "client_id", "role", "connected_at", "task")
+
+    def __init__(self, websocket: WebSocket, client_id: str, role: str,
+                 connected_at: float = 0.0, task: Optional[asyncio.Task] = None):
         self.websocket = websocket
         self.client_id = client_id
-        self.role = role
+        self.role = normalize_role(role)
+        # monotonic connect time and handler task, used by /api/debug/tasks
+        self.connected_at = connected_at
+        self.task = task
 
 
 class Session:
+    __slots__ = ("session_id", "clients", "_peers")
+
     def __init__(self, session_id: str):
         self.session_id = session_id
         self.clients: Dict[str, WSClient] = {}
-        self.lock = asyncio.Lock()
+        self._peers: Optional[List[str]] = None
+
+    def add_client(self, client: WSClient):
+        self.clients[client.client_id] = client
+        self._peers = None
+
+    def remove_client(self, client_id: str) -> Optional[WSClient]:
+        client = self.clients.pop(client_id, None)
+        if client is not None:
+            self._peers = None
+        return client
 
     def peers(self) -> List[str]:
-        return list(self.clients.keys())
+        # Cached until membership changes; callers must not mutate it
+        if self._peers is None:
+            self._peers = list(self.clients.keys())
+        return self._peers
 
 
 sessions: Dict[str, Session] = {}
 
 
 def get_or_create_session(session_id: str) -> Session:
-    if session_id not in sessions:
-        sessions[session_id] = Session(session_id)
-    return sessions[session_id]
+    session = sessions.get(session_id)
+    if session is None:
+        session = sessions[session_id] = Session(session_id)
+    return session
 
 
 async def broadcast_peers(session: Session):
-    payload = {"type": "peers", "peers": session.peers()}
+    text = json.dumps({"type": "peers", "peers": session.peers()})
     for c in list(session.clients.values()):
         try:
-            await c.websocket.send_text(json.dumps(payload))
+            await c.websocket.send_text(text)
         except Exception:
             pass
 
@@ -119,6 +512,7 @@ async def broadcast_peers(session: Session):
 @api_router.websocket("/ws/session/{session_id}")
 async def ws_session(websocket: WebSocket, session_id: str):
     await websocket.accept()
+    connected_at = time.monotonic()
     client_id: Optional[str] = None
     role = "unknown"
     session = get_or_create_session(session_id)
@@ -131,14 +525,29 @@ async def ws_session(websocket: WebSocket, session_id: str):
             return
         client_id = join.get("clientId") or str(uuid.uuid4())
         role = join.get("role", "unknown")
-        async with session.lock:
-            session.clients[client_id] = WSClient(websocket, client_id, role)
+        # No await between lookup and mutation, so no lock is needed
+        client = WSClient(websocket, client_id, role, connected_at, asyncio.current_task())
+        role = client.role
+        session.add_client(client)
+        log_event("session.join", session=session_id, client=client_id, role=role,
+                  peers=len(session.clients))
         await broadcast_peers(session)
 
+        client_ip = websocket.client.host if websocket.client else ""
         while True:
             data = await websocket.receive_text()
+            if RATE_LIMITS_ENABLED and not admission.allow_ws_message(client_ip):
+                await websocket.close(code=1008)
+                break
             msg = json.loads(data)
             mtype = msg.get("type")
+            if RATE_LIMITS_ENABLED and not admission.allow_session_message(client_ip, session_id):
+                # Hand the dropped message back so the sender can resend it
+                await websocket.send_text(json.dumps({
+                    "type": "backoff", "reason": "session-rate",
+                    "retryAfterMs": admission.session_retry_after_ms(), "dropped": msg,
+                }))
+                continue
 
             if mtype in ("sdp-offer", "sdp-answer", "ice-candidate", "text"):
                 target = msg.get("to")
@@ -150,6 +559,8 @@ async def ws_session(websocket: WebSocket, session_id: str):
                         await target_client.websocket.send_text(json.dumps({**msg, "from": client_id}))
                     except Exception:
                         pass
+                log_event("relay", logging.DEBUG, sampled=True, session=session_id,
+                          type=mtype, to=target, delivered=target_client is not None)
             elif mtype == "leave":
                 break
             elif mtype == "ping":
@@ -160,11 +571,13 @@ async def ws_session(websocket: WebSocket, session_id: str):
     except WebSocketDisconnect:
         pass
     except Exception as e:
-        logging.exception("WebSocket error: %s", e)
+        logger.exception("WebSocket error: %s", e)
     finally:
         if client_id:
-            async with session.lock:
-                session.clients.pop(client_id, None)
+            session.remove_client(client_id)
+            log_event("session.leave", session=session_id, client=client_id, role=role,
+                      duration_s=round(time.monotonic() - connected_at, 3),
+                      peers=len(session.clients))
             if len(session.clients) == 0:
                 sessions.pop(session.session_id, None)
         try:
@@ -206,17 +619,24 @@ def connect_ftp(cfg: FTPConfig) -> FTP:
 @api_router.post("/ftp/list")
 async def ftp_list(body: FTPPath):
     def _list():
-        ftp = connect_ftp(body.config)
+        started = time.monotonic()
+        ok = False
+        ftp = None
         try:
+            ftp = connect_ftp(body.config)
             ftp.cwd(body.path)
             lines: List[str] = []
             ftp.retrlines('LIST', lines.append)
+            ok = True
             return {"entries": lines}
         finally:
-            try:
-                ftp.quit()
-            except Exception:
-                pass
+            if ftp is not None:
+                try:
+                    ftp.quit()
+                except Exception:
+                    pass
+            log_event("ftp.list", host=body.config.host, path=body.path, ok=ok,
+                      elapsed_ms=round((time.monotonic() - started) * 1000, 1))
     loop = asyncio.get_event_loop()
     return await loop.run_in_executor(None, _list)
 
@@ -237,19 +657,26 @@ async def ftp_upload(config: str, dest_dir: str = "/", file: UploadFile = File(.
         raise HTTPException(status_code=400, detail=f"Invalid config: {e}")
 
     def _upload():
-        ftp = connect_ftp(cfg)
+        started = time.monotonic()
+        ok = False
+        name = filename or file.filename
+        ftp = None
         try:
+            ftp = connect_ftp(cfg)
             ftp.cwd(dest_dir)
-            name = filename or file.filename
             if not name:
                 raise Exception("Missing filename")
             ftp.storbinary(f"STOR {name}", file.file)
+            ok = True
             return {"ok": True, "path": f"{dest_dir}/{name}"}
         finally:
-            try:
-                ftp.quit()
-            except Exception:
-                pass
+            if ftp is not None:
+                try:
+                    ftp.quit()
+                except Exception:
+                    pass
+            log_event("ftp.upload", host=cfg.host, path=f"{dest_dir}/{name}", ok=ok,
+                      elapsed_ms=round((time.monotonic() - started) * 1000, 1))
     loop = asyncio.get_event_loop()
     return await loop.run_in_executor(None, _upload)
 
@@ -328,15 +755,216 @@ async def host_info():
     return {"port": port, "ips": ips, "urls": urls}
 
 
+# -----------------------------
+# Debug / profiling endpoints (off by default)
+# Enable with DEBUG_API=1 and a DEBUG_API_TOKEN; requests must carry a matching
+# X-Debug-Token header. Without a token the routes are not registered at all.
+# Cross-origin (browser) requests are refused and /api/debug gets no CORS headers.
+# -----------------------------
+DEBUG_API_ENABLED = os.environ.get("DEBUG_API", "0").lower() in ("1", "true", "yes")
+DEBUG_API_TOKEN = os.environ.get("DEBUG_API_TOKEN", "")
+DEBUG_PREFIX = "/api/debug"
+MAX_PROFILE_SECONDS = 60.0
+MAX_TRACE_SECONDS = 600.0
+
+debug_router = APIRouter(prefix=DEBUG_PREFIX)
+_profile_lock = asyncio.Lock()
+
+
+def require_debug_access(request: Request):
+    # Browsers always send Origin on cross-origin requests; admin tools do not
+    if "origin" in request.headers:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    token = request.headers.get("x-debug-token", "")
+    if not DEBUG_API_TOKEN or not hmac.compare_digest(token, DEBUG_API_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float) -> Counter:
+    """Statistically sample one thread's stack; returns collapsed stack -> hits."""
+    counts: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame))
+            frame = frame.f_back
+        if stack:
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return counts
+
+
+@debug_router.get("/profile", dependencies=[Depends(require_debug_access)])
+async def debug_profile(seconds: float = 5.0, mode: str = "sample", interval_ms: float = 5.0, limit: int = 50):
+    """Profile the event loop thread for `seconds`.
+
+    mode=sample returns collapsed stacks (flamegraph.pl / speedscope format),
+    mode=cprofile returns the cProfile stats sorted by cumulative time.
+    """
+    if mode not in ("sample", "cprofile"):
+        raise HTTPException(status_code=400, detail="mode must be 'sample' or 'cprofile'")
+    seconds = max(0.1, min(seconds, MAX_PROFILE_SECONDS))
+    if _profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+    async with _profile_lock:
+        if mode == "sample":
+            interval = max(0.001, interval_ms / 1000.0)
+            loop = asyncio.get_event_loop()
+            counts = await loop.run_in_executor(
+                None, sample_stacks, threading.get_ident(), seconds, interval)
+            lines = [f"{stack} {n}" for stack, n in counts.most_common()]
+            return PlainTextResponse("\n".join(lines) + "\n")
+
+        import cProfile
+        import io
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(max(1, limit))
+        return PlainTextResponse(out.getvalue())
+
+
+@debug_router.get("/tasks", dependencies=[Depends(require_debug_access)])
+async def debug_tasks():
+    """List live ws_session handler tasks per session, plus all other asyncio tasks."""
+    now = time.monotonic()
+    session_tasks = set()
+    out_sessions = []
+    for sid, session in list(sessions.items()):
+        clients = []
+        for c in list(session.clients.values()):
+            if c.task is not None:
+                session_tasks.add(c.task)
+            clients.append({
+                "clientId": c.client_id,
+                "role": c.role,
+                "age_s": round(now - c.connected_at, 3),
+                "task": c.task.get_name() if c.task is not None else None,
+                "done": c.task.done() if c.task is not None else None,
+            })
+        out_sessions.append({"sessionId": sid, "clients": clients})
+
+    other = []
+    for t in asyncio.all_tasks():
+        if t in session_tasks:
+            continue
+        coro = t.get_coro()
+        other.append({
+            "task": t.get_name(),
+            "coro": getattr(coro, "__qualname__", repr(coro)),
+            "done": t.done(),
+        })
+    return {"sessions": out_sessions, "other_tasks": other}
+
+
+# Bounded tracemalloc window: tracing only runs between an explicit start and
+# a stop (manual or after `seconds`); the final snapshot is kept for reading.
+_trace_stop_handle: Optional[asyncio.TimerHandle] = None
+_trace_last_snapshot = None
+
+
+def _stop_tracing():
+    global _trace_stop_handle, _trace_last_snapshot
+    import tracemalloc
+    if _trace_stop_handle is not None:
+        _trace_stop_handle.cancel()
+        _trace_stop_handle = None
+    if tracemalloc.is_tracing():
+        _trace_last_snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+
+def _memory_top(snapshot, key: str, limit: int) -> List[dict]:
+    import tracemalloc
+    if key not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="key must be 'lineno', 'filename' or 'traceback'")
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    top = []
+    for stat in snapshot.statistics(key)[:max(1, limit)]:
+        top.append({
+            "where": [f"{fr.filename}:{fr.lineno}" for fr in stat.traceback],
+            "size": stat.size,
+            "count": stat.count,
+        })
+    return top
+
+
+@debug_router.post("/memory/start", dependencies=[Depends(require_debug_access)])
+async def debug_memory_start(seconds: float = 60.0, frames: int = 1):
+    """Start tracemalloc for at most `seconds`; it stops by itself afterwards."""
+    global _trace_stop_handle, _trace_last_snapshot
+    import tracemalloc
+    if tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="Tracing is already running")
+    seconds = max(1.0, min(seconds, MAX_TRACE_SECONDS))
+    _trace_last_snapshot = None
+    tracemalloc.start(max(1, frames))
+    _trace_stop_handle = asyncio.get_event_loop().call_later(seconds, _stop_tracing)
+    return {"tracing": True, "seconds": seconds}
+
+
+@debug_router.post("/memory/stop", dependencies=[Depends(require_debug_access)])
+async def debug_memory_stop(limit: int = 20, key: str = "lineno"):
+    """Stop tracing now and return the final top allocations."""
+    _stop_tracing()
+    if _trace_last_snapshot is None:
+        raise HTTPException(status_code=409, detail="Tracing is not running")
+    return {"tracing": False, "top": _memory_top(_trace_last_snapshot, key, limit)}
+
+
+@debug_router.get("/memory", dependencies=[Depends(require_debug_access)])
+async def debug_memory(limit: int = 20, key: str = "lineno"):
+    """Top tracemalloc allocations: live while tracing, else from the last window."""
+    import tracemalloc
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        top = _memory_top(tracemalloc.take_snapshot(), key, limit)
+        return {"tracing": True, "current": current, "peak": peak, "top": top}
+    if _trace_last_snapshot is None:
+        raise HTTPException(status_code=409, detail="Tracing is not running; POST /api/debug/memory/start first")
+    return {"tracing": False, "top": _memory_top(_trace_last_snapshot, key, limit)}
+
+
+class APICORSMiddleware(CORSMiddleware):
+    """CORS for every route except /api/debug, which must never be readable cross-origin."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope.get("path", "").startswith(DEBUG_PREFIX):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
 # Include the router in the main app
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
-    CORSMiddleware,
+    APICORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
 )
 app.include_router(api_router)
+if DEBUG_API_ENABLED and DEBUG_API_TOKEN:
+    app.include_router(debug_router)
+elif DEBUG_API_ENABLED:
+    logger.warning("DEBUG_API=1 ignored: set DEBUG_API_TOKEN to enable /api/debug")
 
 # -----------------------------
 # Static frontend (if build available). This does NOT alter /api routes
@@ -355,7 +983,3 @@ if _frontend_dir:
         if index_file.exists():
             return FileResponse(str(index_file))
         return HTMLResponse("Frontend build not found", status_code=404)
-
-# Logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
\ No newline at end of file
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Backend end-to-end benchmarks for WebRTC EasyMesh
+Starts server:app in-process with uvicorn, runs fixed workloads and stores
+pytest-benchmark style JSON. `compare` fails when p95 latency or throughput
+regresses past a threshold against a saved baseline.
+
+    python backend_bench.py run --out bench.json [--smoke]
+    python backend_bench.py compare baseline.json bench.json
+    python backend_bench.py run --out bench.json --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import platform
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+import websockets
+
+# Add backend to path for imports
+backend_path = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_path))
+
+# Keep admission control on so its hot-path cost is measured, but raise the
+# limits so the single-IP churn workloads are not throttled. Per-event logging
+# would measure the console. Configure before server is imported.
+for _name in ("WS_CONNECT_RATE", "WS_CONNECT_BURST", "WS_MSG_RATE", "WS_MSG_BURST",
+              "WS_SESSION_MSG_RATE", "WS_SESSION_MSG_BURST", "FTP_RATE", "FTP_BURST"):
+    os.environ.setdefault(_name, "1000000")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class InProcessServer:
+    """Runs server:app with uvicorn on a background thread with its own loop."""
+
+    def __init__(self):
+        import uvicorn
+        from server import app
+
+        self.port = free_port()
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port,
+                                log_level="warning", log_config=None, lifespan="off")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                raise RuntimeError("uvicorn did not start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+class LocalFTPServer:
+    """pyftpdlib server on a temp dir; None from start() when not installed."""
+
+    def __init__(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.server = None
+        self.thread = None
+        self.port = 0
+
+    def start(self) -> Optional["LocalFTPServer"]:
+        try:
+            from pyftpdlib.authorizers import DummyAuthorizer
+            from pyftpdlib.handlers import FTPHandler
+            from pyftpdlib.servers import FTPServer
+        except ImportError:
+            return None
+        for i in range(20):
+            (Path(self.tmp.name) / f"file-{i}.txt").write_text("x" * 100)
+        authorizer = DummyAuthorizer()
+        authorizer.add_user("bench", "bench", self.tmp.name, perm="elradfmw")
+        handler = type("BenchFTPHandler", (FTPHandler,), {"authorizer": authorizer})
+        self.server = FTPServer(("127.0.0.1", 0), handler)
+        self.port = self.server.address[1]
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"timeout": 0.1}, daemon=True)
+        self.thread.start()
+        return self
+
+    def config(self) -> Dict:
+        return {"host": "127.0.0.1", "port": self.port, "user": "bench",
+                "password": "bench", "passive": True, "cwd": "/"}
+
+    def stop(self):
+        if self.server:
+            self.server.close_all()
+        self.tmp.cleanup()
+
+
+# -----------------------------
+# Workloads: each returns per-iteration latencies in seconds
+# -----------------------------
+async def bench_host_info(base: str, rounds: int) -> List[float]:
+    samples = []
+    async with aiohttp.ClientSession() as session:
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            async with session.get(f"{base}/api/host-info") as response:
+                await response.read()
+                assert response.status == 200, response.status
+            samples.append(time.perf_counter() - t0)
+    return samples
+
+
+async def bench_session_churn(base: str, rounds: int) -> List[float]:
+    ws_url = base.replace("http", "ws") + "/api/ws/session/bench-churn"
+    samples = []
+    for i in range(rounds):
+        t0 = time.perf_counter()
+        async with websockets.connect(ws_url) as ws:
+            await ws.send(json.dumps({"type": "join", "clientId": f"churn-{i}", "role": "guest"}))
+            data = json.loads(await asyncio.wait_for(ws.recv(), timeout=5.0))
+            assert data.get("type") == "peers", data
+            await ws.send(json.dumps({"type": "leave"}))
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+async def bench_relay_round_trip(base: str, rounds: int) -> List[float]:
+    ws_url = base.replace("http", "ws") + "/api/ws/session/bench-relay"
+    samples = []
+    async with websockets.connect(ws_url) as ws1, websockets.connect(ws_url) as ws2:
+        await ws1.send(json.dumps({"type": "join", "clientId": "a", "role": "host"}))
+        await ws1.recv()
+        await ws2.send(json.dumps({"type": "join", "clientId": "b", "role": "guest"}))
+        await ws1.recv()  # peers update for b
+        await ws2.recv()
+        ping = json.dumps({"type": "text", "to": "b", "text": "ping"})
+        pong = json.dumps({"type": "text", "to": "a", "text": "pong"})
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            await ws1.send(ping)
+            await asyncio.wait_for(ws2.recv(), timeout=5.0)
+            await ws2.send(pong)
+            await asyncio.wait_for(ws1.recv(), timeout=5.0)
+            samples.append(time.perf_counter() - t0)
+    return samples
+
+
+async def bench_ftp_list(base: str, rounds: int, ftp: LocalFTPServer) -> List[float]:
+    body = {"config": ftp.config(), "path": "/"}
+    samples = []
+    async with aiohttp.ClientSession() as session:
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            async with session.post(f"{base}/api/ftp/list", json=body) as response:
+                data = await response.json()
+                assert response.status == 200 and len(data["entries"]) >= 20, data
+            samples.append(time.perf_counter() - t0)
+    return samples
+
+
+async def bench_ftp_upload(base: str, rounds: int, ftp: LocalFTPServer) -> List[float]:
+    payload = os.urandom(64 * 1024)
+    params = {"config": json.dumps(ftp.config()), "dest_dir": "/"}
+    samples = []
+    async with aiohttp.ClientSession() as session:
+        for i in range(rounds):
+            form = aiohttp.FormData()
+            form.add_field("file", payload, filename=f"upload-{i}.bin",
+                           content_type="application/octet-stream")
+            t0 = time.perf_counter()
+            async with session.post(f"{base}/api/ftp/upload", params=params, data=form) as response:
+                data = await response.json()
+                assert response.status == 200 and data.get("ok"), data
+            samples.append(time.perf_counter() - t0)
+    return samples
+
+
+# -----------------------------
+# Stats / storage
+# -----------------------------
+def percentile(sorted_samples: List[float], pct: float) -> float:
+    # Nearest-rank, matches what most latency dashboards report
+    k = max(0, min(len(sorted_samples) - 1, math.ceil(pct / 100.0 * len(sorted_samples)) - 1))
+    return sorted_samples[k]
+
+
+def compute_stats(samples: List[float], wall: float) -> Dict:
+    data = sorted(samples)
+    return {
+        "rounds": len(data),
+        "min": data[0],
+        "max": data[-1],
+        "mean": statistics.fmean(data),
+        "stddev": statistics.stdev(data) if len(data) > 1 else 0.0,
+        "median": statistics.median(data),
+        "p95": percentile(data, 95),
+        "p99": percentile(data, 99),
+        "ops": len(data) / wall if wall > 0 else 0.0,
+    }
+
+
+async def run_benchmark(name: str, fn: Callable, rounds: int, warmup: int, results: List[Dict]):
+    await fn(warmup)
+    t0 = time.perf_counter()
+    samples = await fn(rounds)
+    stats = compute_stats(samples, time.perf_counter() - t0)
+    results.append({"name": name, "stats": stats})
+    print(f"⏱️  {name:<20} p50={stats['median'] * 1000:8.2f}ms "
+          f"p95={stats['p95'] * 1000:8.2f}ms ops={stats['ops']:9.1f}/s")
+
+
+async def run_all_benchmarks(base: str, scale: float, only: Optional[List[str]]) -> List[Dict]:
+    def rounds(n: int) -> int:
+        return max(5, int(n * scale))
+
+    ftp = LocalFTPServer().start()
+    if ftp is None:
+        print("⚠️  pyftpdlib not installed; skipping FTP workloads")
+
+    workloads = [
+        ("host_info", lambda n: bench_host_info(base, n), rounds(200)),
+        ("session_churn", lambda n: bench_session_churn(base, n), rounds(200)),
+        ("relay_round_trip", lambda n: bench_relay_round_trip(base, n), rounds(1000)),
+    ]
+    if ftp is not None:
+        workloads += [
+            ("ftp_list", lambda n: bench_ftp_list(base, n, ftp), rounds(50)),
+            ("ftp_upload", lambda n: bench_ftp_upload(base, n, ftp), rounds(50)),
+        ]
+
+    results: List[Dict] = []
+    try:
+        for name, fn, n in workloads:
+            if only and name not in only:
+                continue
+            await run_benchmark(name, fn, n, max(1, n // 10), results)
+    finally:
+        if ftp is not None:
+            ftp.stop()
+    return results
+
+
+def machine_info() -> Dict:
+    return {
+        "node": platform.node(),
+        "processor": platform.processor(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "release": platform.release(),
+        "python_version": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+# -----------------------------
+# Regression gate
+# -----------------------------
+def compare(baseline: Dict, current: Dict, p95_threshold: float, ops_threshold: float,
+            allow_missing: bool = False) -> bool:
+    """Print a comparison table; False when any benchmark regressed, or is
+    missing from the current run unless allow_missing is set."""
+    base_by_name = {b["name"]: b["stats"] for b in baseline.get("benchmarks", [])}
+    ok = True
+    print(f"{'benchmark':<20} {'p95 base':>10} {'p95 now':>10} {'Δp95':>8} "
+          f"{'ops base':>10} {'ops now':>10} {'Δops':>8}")
+    for bench in current.get("benchmarks", []):
+        name, now = bench["name"], bench["stats"]
+        base = base_by_name.pop(name, None)
+        if base is None:
+            print(f"{name:<20} (no baseline)")
+            continue
+        d_p95 = now["p95"] / base["p95"] - 1 if base["p95"] else 0.0
+        d_ops = now["ops"] / base["ops"] - 1 if base["ops"] else 0.0
+        regressed = d_p95 > p95_threshold or d_ops < -ops_threshold
+        ok = ok and not regressed
+        print(f"{name:<20} {base['p95'] * 1000:>9.2f}ms {now['p95'] * 1000:>9.2f}ms {d_p95:>+7.0%} "
+              f"{base['ops']:>10.1f} {now['ops']:>10.1f} {d_ops:>+7.0%}"
+              f"{'  ❌ REGRESSED' if regressed else ''}")
+    for name in base_by_name:
+        print(f"{name:<20} (missing from current run){'' if allow_missing else '  ❌ MISSING'}")
+        ok = ok and allow_missing
+    return ok
+
+
+def load_json(path: str) -> Dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def cmd_run(args) -> int:
+    with InProcessServer() as srv:
+        print(f"🔧 Benchmarking in-process server at: {srv.base_url}")
+        if args.smoke:
+            # Reuse the functional smoke tests against the same server
+            os.environ["REACT_APP_BACKEND_URL"] = srv.base_url
+            import backend_test
+            from server import get_frontend_build_dir
+            # A fresh checkout has no frontend/build, so there is no static root to check
+            require_frontend = get_frontend_build_dir() is not None
+            if not asyncio.run(backend_test.run_all_tests(require_frontend)):
+                print("\n💥 Smoke tests failed; not benchmarking")
+                return 1
+        benchmarks = asyncio.run(run_all_benchmarks(srv.base_url, args.scale, args.only))
+
+    result = {
+        "machine_info": machine_info(),
+        "datetime": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "benchmarks": benchmarks,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"\n💾 Saved results to {args.out}")
+
+    if args.compare:
+        if not compare(load_json(args.compare), result, args.p95_threshold, args.ops_threshold,
+                       args.allow_missing):
+            print("\n💥 Performance regression against baseline!")
+            return 1
+        print("\n🎉 No regressions against baseline")
+    return 0
+
+
+def cmd_compare(args) -> int:
+    if not compare(load_json(args.baseline), load_json(args.current), args.p95_threshold, args.ops_threshold,
+                   args.allow_missing):
+        print("\n💥 Performance regression against baseline!")
+        return 1
+    print("\n🎉 No regressions against baseline")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="EasyMesh backend benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_thresholds(p):
+        p.add_argument("--p95-threshold", type=float, default=0.25,
+                       help="allowed relative p95 latency increase (default 0.25 = +25%%)")
+        p.add_argument("--ops-threshold", type=float, default=0.25,
+                       help="allowed relative throughput decrease (default 0.25 = -25%%)")
+        p.add_argument("--allow-missing", action="store_true",
+                       help="pass even if baseline benchmarks are missing from the current run")
+
+    run = sub.add_parser("run", help="run the workloads and save JSON results")
+    run.add_argument("--out", default="bench.json")
+    run.add_argument("--scale", type=float, default=1.0, help="multiply the number of rounds")
+    run.add_argument("--only", nargs="+", help="run only these benchmarks")
+    run.add_argument("--smoke", action="store_true", help="run backend_test.py smoke tests first")
+    run.add_argument("--compare", metavar="BASELINE", help="fail on regression against this file")
+    add_thresholds(run)
+    run.set_defaults(func=cmd_run)
+
+    cmp_ = sub.add_parser("compare", help="compare two result files")
+    cmp_.add_argument("baseline")
+    cmp_.add_argument("current")
+    add_thresholds(cmp_)
+    cmp_.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        print("\n⏹️  Benchmarks interrupted by user")
+        sys.exit(1)
@@ -5,8 +5,10 @@ Tests the FastAPI backend endpoints and WebSocket functionality
 """
 
 import asyncio
+import contextlib
 import json
 import os
+import socket
 import sys
 import time
 from pathlib import Path
@@ -51,6 +53,14 @@ class TestResults:
             self.failed += 1
             print(f"❌ {test_name}: {message}")
     
+    def skip(self, test_name: str, message: str = ""):
+        self.results.append({
+            "test": test_name,
+            "passed": None,
+            "message": message
+        })
+        print(f"⏭️  {test_name}: {message}")
+    
     def summary(self):
         total = self.passed + self.failed
         print(f"\n📊 Test Summary: {self.passed}/{total} passed")
@@ -302,8 +312,211 @@ async def test_root_static_serving():
     except Exception as e:
         return False, f"Root static test failed: {str(e)}"
 
-async def run_all_tests():
-    """Run all backend tests"""
+# -----------------------------
+# Admission control tests. These run against an in-process server (see
+# backend_bench.InProcessServer) with low limits swapped in per test, since
+# the limits are read from the environment when server.Admission is created.
+# -----------------------------
+@contextlib.contextmanager
+def admission_limits(**limits):
+    """Install a fresh server.Admission built with the given env limits"""
+    import server
+    saved_env = {k: os.environ.get(k) for k in limits}
+    saved = (server.admission, server.RATE_LIMITS_ENABLED)
+    os.environ.update({k: str(v) for k, v in limits.items()})
+    server.admission = server.Admission()
+    server.RATE_LIMITS_ENABLED = True
+    try:
+        yield server.admission
+    finally:
+        server.admission, server.RATE_LIMITS_ENABLED = saved
+        for k, v in saved_env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+def handshake_status(exc: Exception) -> Optional[int]:
+    """HTTP status of a rejected websocket handshake (old and new websockets APIs)"""
+    response = getattr(exc, "response", None)
+    if response is not None and hasattr(response, "status_code"):
+        return response.status_code
+    return getattr(exc, "status_code", None)
+
+def close_code(exc: ConnectionClosed) -> Optional[int]:
+    return exc.rcvd.code if exc.rcvd is not None else None
+
+async def wait_released(admission, timeout: float = 3.0) -> bool:
+    """Counters drop back once the server has finished the closed connections"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if (admission.ws_total == 0 and not admission.ws_per_ip and not admission.ws_per_session
+                and admission.ftp_in_flight == 0 and not admission.ftp_per_ip):
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+async def fetch_admission_stats(base_url: str) -> Dict:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{base_url}/api/admission/stats") as response:
+            return await response.json()
+
+async def test_rate_limiter_buckets(base_url: str):
+    """Token bucket refill and pruning of idle buckets"""
+    import server
+    try:
+        limiter = server.RateLimiter(rate=20, burst=2)
+        if not (limiter.allow("a") and limiter.allow("a")) or limiter.allow("a"):
+            return False, "Bucket did not allow exactly its burst"
+        await asyncio.sleep(0.1)
+        if not limiter.allow("a"):
+            return False, "Bucket did not refill"
+
+        limiter = server.RateLimiter(rate=100, burst=1, max_keys=2)
+        limiter.allow("a")
+        limiter.allow("b")
+        await asyncio.sleep(0.05)
+        limiter.allow("c")  # over max_keys: prunes a and b, which have refilled
+        if set(limiter.buckets) != {"c"}:
+            return False, f"Idle buckets not pruned: {sorted(limiter.buckets)}"
+        return True, "Buckets refill and idle buckets are pruned"
+    except Exception as e:
+        return False, f"Rate limiter test failed: {str(e)}"
+
+async def test_admission_ws_per_ip(base_url: str):
+    """Connections over WS_MAX_PER_IP are rejected at the handshake and counters recover"""
+    ws_url = base_url.replace("http", "ws") + "/api/ws/session/test-admission-ip"
+    try:
+        with admission_limits(WS_MAX_PER_IP=2) as admission:
+            async with websockets.connect(ws_url) as ws1, websockets.connect(ws_url) as ws2:
+                for i, ws in enumerate((ws1, ws2)):
+                    await ws.send(json.dumps({"type": "join", "clientId": f"ip-{i}", "role": "peer"}))
+                    await asyncio.wait_for(ws.recv(), timeout=5.0)
+                try:
+                    async with websockets.connect(ws_url):
+                        return False, "Third connection from the same IP was accepted"
+                except ConnectionClosed:
+                    return False, "Third connection was accepted then closed, expected a handshake rejection"
+                except Exception as e:
+                    status = handshake_status(e)
+                    if status not in (403, 429):
+                        return False, f"Expected handshake status 403/429, got {status}: {e}"
+            if not await wait_released(admission):
+                return False, f"Counters not released: total={admission.ws_total} per_ip={dict(admission.ws_per_ip)}"
+            stats = await fetch_admission_stats(base_url)
+            if stats["rejected"].get("ws_connect.ip_concurrency") != 1 or stats["ws_connections"] != 0:
+                return False, f"Unexpected stats: {stats}"
+            return True, f"Third connection rejected with HTTP {status}, counters back to 0"
+    except Exception as e:
+        return False, f"WS per-IP admission test failed: {str(e)}"
+
+async def test_admission_ws_message_rate(base_url: str):
+    """A client over its own per-IP message rate is closed with 1008"""
+    ws_url = base_url.replace("http", "ws") + "/api/ws/session/test-admission-msg"
+    try:
+        with admission_limits(WS_MSG_RATE=0.01, WS_MSG_BURST=2) as admission:
+            async with websockets.connect(ws_url) as ws:
+                await ws.send(json.dumps({"type": "join", "clientId": "flooder", "role": "peer"}))
+                await asyncio.wait_for(ws.recv(), timeout=5.0)
+                for _ in range(2):
+                    await ws.send(json.dumps({"type": "ping"}))
+                    data = json.loads(await asyncio.wait_for(ws.recv(), timeout=5.0))
+                    if data.get("type") != "pong":
+                        return False, f"Expected pong within burst, got {data}"
+                await ws.send(json.dumps({"type": "ping"}))
+                try:
+                    data = await asyncio.wait_for(ws.recv(), timeout=5.0)
+                    return False, f"Expected close 1008, got message {data}"
+                except ConnectionClosed as e:
+                    if close_code(e) != 1008:
+                        return False, f"Expected close code 1008, got {close_code(e)}"
+            if not await wait_released(admission):
+                return False, f"Counters not released: total={admission.ws_total}"
+            if admission.rejected.get("ws_message.ip_rate") != 1:
+                return False, f"Unexpected counters: {dict(admission.rejected)}"
+            return True, "Flooding client closed with 1008, counters back to 0"
+    except Exception as e:
+        return False, f"WS message rate test failed: {str(e)}"
+
+async def test_admission_session_backoff(base_url: str):
+    """Over the per-session rate messages are dropped with a backoff frame, nobody is closed"""
+    ws_url = base_url.replace("http", "ws") + "/api/ws/session/test-admission-session"
+    try:
+        with admission_limits(WS_SESSION_MSG_RATE=0.01, WS_SESSION_MSG_BURST=1) as admission:
+            async with websockets.connect(ws_url) as ws1, websockets.connect(ws_url) as ws2:
+                await ws1.send(json.dumps({"type": "join", "clientId": "sess-a", "role": "host"}))
+                await ws1.recv()
+                await ws2.send(json.dumps({"type": "join", "clientId": "sess-b", "role": "peer"}))
+                await ws1.recv()
+                await ws2.recv()
+
+                first = {"type": "text", "to": "sess-b", "text": "one"}
+                await ws1.send(json.dumps(first))
+                data = json.loads(await asyncio.wait_for(ws2.recv(), timeout=5.0))
+                if data.get("text") != "one":
+                    return False, f"First message not relayed: {data}"
+
+                second = {"type": "text", "to": "sess-b", "text": "two"}
+                await ws1.send(json.dumps(second))
+                data = json.loads(await asyncio.wait_for(ws1.recv(), timeout=5.0))
+                if data.get("type") != "backoff" or data.get("dropped") != second or not data.get("retryAfterMs"):
+                    return False, f"Expected backoff frame for the sender, got {data}"
+
+                # The other peer is still connected and gets its own backoff
+                await ws2.send(json.dumps({"type": "ping"}))
+                data = json.loads(await asyncio.wait_for(ws2.recv(), timeout=5.0))
+                if data.get("type") != "backoff":
+                    return False, f"Expected backoff for second peer, got {data}"
+            if not await wait_released(admission):
+                return False, f"Counters not released: total={admission.ws_total}"
+            if admission.rejected.get("ws_message.session_rate") != 2:
+                return False, f"Unexpected counters: {dict(admission.rejected)}"
+            return True, "Session overrun dropped with backoff frames, no peer closed"
+    except Exception as e:
+        return False, f"Session backoff test failed: {str(e)}"
+
+async def test_admission_ftp_rate(base_url: str):
+    """FTP calls over FTP_RATE get 429 before any FTP work and slots are released on errors"""
+    # Nothing listens on this port, so the admitted call fails fast with 400
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        dead_port = s.getsockname()[1]
+    body = {"config": {"host": "127.0.0.1", "port": dead_port, "user": "x", "password": "x"}, "path": "/"}
+    try:
+        with admission_limits(FTP_RATE=0.01, FTP_BURST=1) as admission:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{base_url}/api/ftp/list", json=body) as response:
+                    if response.status != 400:
+                        return False, f"First call: expected 400 from the dead FTP port, got {response.status}"
+                async with session.post(f"{base_url}/api/ftp/list", json=body) as response:
+                    if response.status != 429 or response.headers.get("Retry-After") != "1":
+                        return False, f"Second call: expected 429 with Retry-After, got {response.status}"
+            if not await wait_released(admission):
+                return False, f"FTP slots not released: in_flight={admission.ftp_in_flight}"
+            stats = await fetch_admission_stats(base_url)
+            if stats["rejected"].get("ftp.ip_rate") != 1 or stats["ftp_in_flight"] != 0:
+                return False, f"Unexpected stats: {stats}"
+            return True, "Second FTP call rejected with 429, slots released after the failed call"
+    except Exception as e:
+        return False, f"FTP rate test failed: {str(e)}"
+
+async def run_admission_tests(results: TestResults):
+    """Admission control tests against an in-process server"""
+    from backend_bench import InProcessServer
+    with InProcessServer() as srv:
+        for name, test in (
+            ("Rate limiter refill/prune", test_rate_limiter_buckets),
+            ("Admission WS per-IP ceiling", test_admission_ws_per_ip),
+            ("Admission WS message rate 1008", test_admission_ws_message_rate),
+            ("Admission session rate backoff", test_admission_session_backoff),
+            ("Admission FTP rate 429", test_admission_ftp_rate),
+        ):
+            passed, message = await test(srv.base_url)
+            results.add_result(name, passed, message)
+
+async def run_all_tests(require_frontend: bool = True):
+    """Run all backend tests. With require_frontend=False the static root
+    check is skipped (the server has no frontend/build to serve)."""
     results = TestResults()
     
     print("🚀 Starting Backend Smoke Tests\n")
@@ -337,8 +550,14 @@ async def run_all_tests():
     results.add_result("API 404 handling", passed, message)
     
     # Test 8: Root static serving
-    passed, message = await test_root_static_serving()
-    results.add_result("Root static file serving", passed, message)
+    if require_frontend:
+        passed, message = await test_root_static_serving()
+        results.add_result("Root static file serving", passed, message)
+    else:
+        results.skip("Root static file serving", "no frontend build")
+    
+    # Tests 9-13: Admission control (in-process server)
+    await run_admission_tests(results)
     
     return results.summary()
 